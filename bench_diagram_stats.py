@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Times diagram_stats() on generated diagrams of 1k, 10k and 100k lines.
+
+    $ python bench_diagram_stats.py
+"""
+import random
+import time
+
+from mermaid import diagram_stats
+
+SIZES = (1_000, 10_000, 100_000)
+
+
+def architecture_diagram(n, deep=False):
+    """~10% groups (random tree, or one chain if deep), ~50% services, rest edges."""
+    out = ["architecture-beta"]
+    n_groups = n // 10
+    for i in range(n_groups):
+        if i == 0:
+            parent = ""
+        elif deep:
+            parent = f" in g{i - 1}"
+        else:
+            parent = f" in g{random.randrange(i)}" if random.random() < 0.7 else ""
+        out.append(f"  group g{i}(aws:region)[Group {i}]{parent}")
+    services = 0
+    while len(out) < n * 0.6:
+        out.append(f"  service s{services}(aws:lambda)[Service {services}] in g{random.randrange(n_groups)}")
+        services += 1
+    while len(out) < n:
+        out.append(f"  s{random.randrange(services)}:R -[call]-> L:s{random.randrange(services)}")
+    return "\n".join(out)
+
+
+def group_chain(n):
+    """n groups, each nested in the previous one."""
+    out = ["architecture-beta", "  group g0(aws:region)[Group 0]"]
+    out += [f"  group g{i}(aws:region)[Group {i}] in g{i - 1}" for i in range(1, n)]
+    return "\n".join(out)
+
+
+def flowchart(n, nesting=0):
+    """Random edges, wrapped in `nesting` nested subgraphs."""
+    out = ["flowchart LR"]
+    out += [f"  subgraph sg{i}" for i in range(nesting)]
+    out += [f"  n{random.randrange(n // 2)}[Node] -->|x| n{random.randrange(n // 2)}" for _ in range(n - 1 - 2 * nesting)]
+    out += ["  end"] * nesting
+    return "\n".join(out)
+
+
+def with_frontmatter(code):
+    """Same diagram behind a YAML frontmatter block; stats must not change."""
+    return "---\ntitle: Bench\nconfig:\n  theme: dark\n---\n" + code
+
+
+def bench(name, code):
+    start = time.perf_counter()
+    stats = diagram_stats(code)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<34} {stats['lines']:>7} lines {elapsed * 1000:8.1f} ms "
+          f"{elapsed * 1e6 / stats['lines']:6.2f} us/line  "
+          f"nodes={stats['nodes']} groups={stats['groups']} depth={stats['max_depth']}")
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    for n in SIZES:
+        code = architecture_diagram(n)
+        bench(f"architecture {n}", code)
+        bench(f"architecture {n} (frontmatter)", with_frontmatter(code))
+        bench(f"architecture {n} (deep)", architecture_diagram(n, deep=True))
+        bench(f"group chain {n}", group_chain(n))
+        bench(f"flowchart {n}", flowchart(n))
+        bench(f"flowchart {n} (20 subgraphs)", flowchart(n, nesting=20))
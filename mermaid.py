@@ -1,5 +1,11 @@
 from flask import Flask, request, render_template_string, jsonify, send_from_directory
+from concurrent.futures import ProcessPoolExecutor
+import click
+import hashlib
+import json
+import os
 import pathlib
+import re
 
 app = Flask(__name__)
 
@@ -15,6 +21,295 @@ PACKS_DIR.mkdir(parents=True, exist_ok=True)
 AWS_LOCAL = PACKS_DIR / "aws-icons-mermaid.json"
 GCP_LOCAL = PACKS_DIR / "gcp-icons-mermaid.json"
 OTHER_LOCAL = PACKS_DIR / "logos-icons-mermaid.json"
+PACK_FILES = {"aws": AWS_LOCAL, "gcp": GCP_LOCAL, "logos": OTHER_LOCAL}
+
+# Icon thumbnail sprite sheets, built from the local packs
+SPRITES_DIR = pathlib.Path(app.root_path) / "static" / "sprites"
+SPRITES_DIR.mkdir(parents=True, exist_ok=True)
+SPRITE_THUMB_SIZE = 32
+SPRITE_COLUMNS = 32
+SPRITE_ROWS = 32
+SPRITE_CHUNK = 64
+_sprite_digests = {}
+
+# Complexity limits checked before the browser is asked to render a diagram
+MAX_DIAGRAM_LINES = int(os.environ.get("MERMAID_MAX_LINES", 5000))
+MAX_DIAGRAM_NODES = int(os.environ.get("MERMAID_MAX_NODES", 500))
+MAX_DIAGRAM_EDGES = int(os.environ.get("MERMAID_MAX_EDGES", 1000))
+MAX_GROUP_DEPTH = int(os.environ.get("MERMAID_MAX_GROUP_DEPTH", 8))
+MAX_LAYOUT_COST = int(os.environ.get("MERMAID_MAX_LAYOUT_COST", 1_000_000))
+
+# architecture-beta declarations: service/group/junction <id>[(icon)][[label]] [in <parent>]
+DECL_RE = re.compile(r"^(service|group|junction)\s+([\w-]+)(?:\([^)]*\))?(?:\[[^\]]*\])?(?:\s+in\s+([\w-]+))?$")
+EDGE_RE = re.compile(r"--|->|<-|==|-\.")
+# flowchart/graph: arrows (with inline text), |edge labels| and & separate the node ids on a line
+ARROW_RE = re.compile(r"<?--[^->]*-->|<?-\.[^.]*\.->|<?==[^=>]*==>|<?[-=.]{2,}[>ox]?|<?-{1,2}>{1,2}|\|[^|]*\||&")
+NODE_ID_RE = re.compile(r"\w+")
+FLOWCHART_KEYWORDS = ("style", "classDef", "class", "click", "linkStyle", "direction")
+
+
+def diagram_stats(code):
+    """Single pass over the diagram text: counts nodes, edges, groups and nesting depth.
+
+    architecture-beta is parsed exactly. For flowchart/graph, nodes are estimated
+    from the ids on edge and node lines and groups are subgraph blocks. Other
+    diagram types only get line and edge counts.
+    """
+    lines = 0
+    nodes = 0
+    edges = 0
+    parents = {}
+    group_ids = []
+    flow_ids = set()
+    flow_depth = 0
+    flow_top = None
+    max_depth = 0
+    top_level = {}
+    kind = None
+    frontmatter = False
+    for raw in code.splitlines():
+        line = raw.strip()
+        if not line or line.startswith("%%"):
+            continue
+        # YAML frontmatter (--- ... ---) may precede the diagram type
+        if kind is None and line == "---":
+            frontmatter = not frontmatter
+            continue
+        if frontmatter:
+            continue
+        lines += 1
+        if kind is None:
+            if line.startswith("architecture"):
+                kind = "architecture"
+            elif line.startswith(("flowchart", "graph")):
+                kind = "flowchart"
+            else:
+                kind = "other"
+            continue
+
+        if kind == "architecture":
+            m = DECL_RE.match(line)
+            if m:
+                decl, node_id, parent = m.groups()
+                if decl == "group":
+                    group_ids.append(node_id)
+                else:
+                    nodes += 1
+                parents[node_id] = parent
+                continue
+        elif kind == "flowchart":
+            if line.startswith("subgraph"):
+                group_ids.append(line)
+                flow_depth += 1
+                max_depth = max(max_depth, flow_depth)
+                if flow_depth == 1:
+                    m = NODE_ID_RE.match(line[len("subgraph"):].strip().strip('"'))
+                    flow_top = m.group() if m else f"subgraph{len(group_ids)}"
+                continue
+            if line == "end":
+                flow_depth = max(0, flow_depth - 1)
+                if flow_depth == 0:
+                    flow_top = None
+                continue
+            if line.startswith(FLOWCHART_KEYWORDS):
+                continue
+            is_edge = EDGE_RE.search(line) is not None
+            edges += is_edge
+            for segment in (ARROW_RE.split(line) if is_edge else (line,)):
+                m = NODE_ID_RE.match(segment.strip())
+                if m and m.group() not in flow_ids:
+                    flow_ids.add(m.group())
+                    if flow_top is not None:
+                        top_level[flow_top] = top_level.get(flow_top, 0) + 1
+            continue
+        if EDGE_RE.search(line):
+            edges += 1
+
+    if kind == "flowchart":
+        nodes = len(flow_ids)
+    elif kind == "architecture":
+        # Depth and top-level ancestor of every declared group, memoised so each
+        # chain is walked once; undeclared parents end the chain
+        group_set = set(group_ids)
+        depth = {}
+        root = {}
+        for gid in group_ids:
+            chain = []
+            seen = set()
+            cur = gid
+            while cur in group_set and cur not in depth and cur not in seen:
+                chain.append(cur)
+                seen.add(cur)
+                cur = parents.get(cur)
+            if cur in depth:
+                base, top = depth[cur], root[cur]
+            else:
+                base, top = 0, chain[-1]
+            for node_id in reversed(chain):
+                base += 1
+                depth[node_id] = base
+                root[node_id] = top
+        max_depth = max(depth.values(), default=0)
+
+        # Nodes per top-level group, used to suggest how to split the diagram
+        for node_id, parent in parents.items():
+            if node_id in depth or parent not in root:
+                continue
+            top = root[parent]
+            top_level[top] = top_level.get(top, 0) + 1
+
+    # Rough layout cost: quadratic in elements, edges add work on top
+    elements = nodes + len(group_ids)
+    layout_cost = elements * elements + edges * elements
+
+    return {
+        "lines": lines,
+        "nodes": nodes,
+        "edges": edges,
+        "groups": len(group_ids),
+        "max_depth": max_depth,
+        "layout_cost": layout_cost,
+        "top_level_groups": top_level,
+    }
+
+
+def check_diagram_limits(stats):
+    errors = []
+    checks = [
+        ("lines", MAX_DIAGRAM_LINES, "Too many lines"),
+        ("nodes", MAX_DIAGRAM_NODES, "Too many nodes"),
+        ("edges", MAX_DIAGRAM_EDGES, "Too many edges"),
+        ("max_depth", MAX_GROUP_DEPTH, "Groups nested too deeply"),
+        ("layout_cost", MAX_LAYOUT_COST, "Estimated layout cost too high"),
+    ]
+    for key, limit, label in checks:
+        if stats[key] > limit:
+            errors.append(f"{label}: {stats[key]} (limit {limit})")
+    return errors
+
+
+def split_suggestion(stats):
+    groups = sorted(stats["top_level_groups"].items(), key=lambda kv: kv[1], reverse=True)
+    if not groups:
+        return "Split the diagram into smaller diagrams, e.g. one per group."
+    parts = ", ".join(f"{gid} ({count} nodes)" for gid, count in groups[:5])
+    return f"Split the diagram by top-level group, one diagram each: {parts}."
+
+
+def _icon_svg(pack, icon):
+    width = icon.get("width", pack.get("width", 16))
+    height = icon.get("height", pack.get("height", 16))
+    left = icon.get("left", pack.get("left", 0))
+    top = icon.get("top", pack.get("top", 0))
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'width="{width}" height="{height}" viewBox="{left} {top} {width} {height}">{icon["body"]}</svg>'
+    ), width, height
+
+
+def _rasterize_chunk(items, size):
+    """Process pool worker: renders (name, svg, width, height) items to RGBA thumbnails.
+
+    Returns the tiles and the names of icons that failed to render.
+    """
+    import io
+    import cairosvg
+    from PIL import Image
+
+    tiles = []
+    skipped = []
+    for name, svg, width, height in items:
+        scale = size / max(width, height, 1)
+        w, h = max(1, round(width * scale)), max(1, round(height * scale))
+        try:
+            png = cairosvg.svg2png(bytestring=svg.encode(), output_width=w, output_height=h)
+            img = Image.open(io.BytesIO(png)).convert("RGBA")
+        except Exception as e:
+            skipped.append(f"{name}: {e}")
+            continue
+        tile = Image.new("RGBA", (size, size))
+        tile.paste(img, ((size - img.width) // 2, (size - img.height) // 2))
+        tiles.append((name, tile.tobytes()))
+    return tiles, skipped
+
+
+def sprite_digest(pack_name):
+    """Cache key of a pack's sprite sheets: pack contents plus the sheet layout.
+
+    Hashing a pack is only repeated when its mtime or size changes.
+    """
+    path = PACK_FILES[pack_name]
+    st = path.stat()
+    layout = f"{SPRITE_THUMB_SIZE}:{SPRITE_COLUMNS}:{SPRITE_ROWS}"
+    stamp = (st.st_mtime_ns, st.st_size, layout)
+    cached = _sprite_digests.get(pack_name)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    h = hashlib.sha256(path.read_bytes())
+    h.update(layout.encode())
+    digest = h.hexdigest()[:16]
+    _sprite_digests[pack_name] = (stamp, digest)
+    return digest
+
+
+def load_sprites(pack_name):
+    """Returns the sprite map for the current pack version, or None if it has not been built."""
+    map_path = SPRITES_DIR / f"{pack_name}-{sprite_digest(pack_name)}.json"
+    if not map_path.exists():
+        return None
+    return json.loads(map_path.read_text())
+
+
+def build_sprites(pack_name):
+    """Rasterizes every icon of a local pack into sprite sheets, cached by sprite_digest()."""
+    # cairosvg loads the system libcairo on import, so a missing library fails
+    # here (ImportError/OSError) before any worker is started
+    import cairosvg  # noqa: F401
+    from PIL import Image, features
+
+    sprite_map = load_sprites(pack_name)
+    if sprite_map is not None:
+        return sprite_map
+
+    digest = sprite_digest(pack_name)
+    pack = json.loads(PACK_FILES[pack_name].read_bytes())
+    items = [(name, *_icon_svg(pack, icon)) for name, icon in pack.get("icons", {}).items()]
+    chunks = [items[i:i + SPRITE_CHUNK] for i in range(0, len(items), SPRITE_CHUNK)]
+    size = SPRITE_THUMB_SIZE
+    tiles = []
+    skipped = []
+    with ProcessPoolExecutor() as pool:
+        for chunk_tiles, chunk_skipped in pool.map(_rasterize_chunk, chunks, [size] * len(chunks)):
+            tiles += chunk_tiles
+            skipped += chunk_skipped
+
+    ext = "webp" if features.check("webp") else "png"
+    per_sheet = SPRITE_COLUMNS * SPRITE_ROWS
+    sheets = []
+    icons = {}
+    for start in range(0, len(tiles), per_sheet):
+        batch = tiles[start:start + per_sheet]
+        rows = (len(batch) + SPRITE_COLUMNS - 1) // SPRITE_COLUMNS
+        sheet = Image.new("RGBA", (SPRITE_COLUMNS * size, rows * size))
+        for i, (name, data) in enumerate(batch):
+            x, y = (i % SPRITE_COLUMNS) * size, (i // SPRITE_COLUMNS) * size
+            sheet.paste(Image.frombytes("RGBA", (size, size), data), (x, y))
+            icons[name] = [len(sheets), x, y]
+        filename = f"{pack_name}-{digest}-{len(sheets)}.{ext}"
+        if ext == "webp":
+            sheet.save(SPRITES_DIR / filename, lossless=True)
+        else:
+            sheet.save(SPRITES_DIR / filename, optimize=True)
+        sheets.append({"url": f"/static/sprites/{filename}", "width": sheet.width, "height": sheet.height})
+
+    # Drop sheets left over from older versions of this pack
+    for old in SPRITES_DIR.glob(f"{pack_name}-*"):
+        if not old.name.startswith(f"{pack_name}-{digest}"):
+            old.unlink()
+
+    sprite_map = {"hash": digest, "size": size, "sheets": sheets, "icons": icons, "skipped": skipped}
+    (SPRITES_DIR / f"{pack_name}-{digest}.json").write_text(json.dumps(sprite_map))
+    return sprite_map
 
 HTML = r"""
 <!doctype html>
@@ -47,6 +342,14 @@ HTML = r"""
         transition: background-color 0.2s, border-color 0.2s;
         user-select: none; /* Mencegah seleksi teks saat double click */
     }
+    .icon-thumb {
+        display: inline-block;
+        width: 16px;
+        height: 16px;
+        margin-right: 4px;
+        vertical-align: -3px;
+        background-repeat: no-repeat;
+    }
     .icon-item:hover {
         background-color: #e0e0e0;
     }
@@ -147,6 +450,7 @@ HTML = r"""
   let awsIconData = null;
   let gcpIconData = null;
   let logosIconData = null;
+  let spriteMaps = {};
   let serviceCounters = {};
 
   mermaid.initialize({ startOnLoad: false, securityLevel: 'loose' });
@@ -197,7 +501,7 @@ HTML = r"""
           const gcpIcons = (gcpIconData && gcpIconData.icons) ? Object.keys(gcpIconData.icons) : [];
           const logosIcons = (logosIconData && logosIconData.icons) ? Object.keys(logosIconData.icons) : [];
 
-          const createIconSpan = (prefix, name) => `<span class="icon-item" data-icon-name="${prefix}:${name}">${prefix}:${name}</span>`;
+          const createIconSpan = (prefix, name) => `<span class="icon-item" data-icon-name="${prefix}:${name}">${iconThumb(prefix, name)}${prefix}:${name}</span>`;
 
           if (!awsIcons.length && !gcpIcons.length && !logosIcons.length){
               listEl.textContent = "⚠️ No icons loaded.";
@@ -253,12 +557,43 @@ HTML = r"""
               });
               
               updateUsedIconHighlighting();
+              loadSpriteMaps().then(addIconThumbs);
           }
       } catch(e) {
           listEl.textContent = "⚠️ Failed to load icon lists.";
       }
   }
 
+  async function loadSpriteMaps() {
+      const packs = { aws: AWS_PACK_URL === AWS_LOCAL, gcp: GCP_PACK_URL === GCP_LOCAL, logos: OTHER_PACK_URL === OTHER_LOCAL };
+      await Promise.all(Object.entries(packs).map(async ([prefix, offline]) => {
+          if (!offline || prefix in spriteMaps) return;
+          // false marks a pack without sprites so it is only asked for once
+          spriteMaps[prefix] = false;
+          spriteMaps[prefix] = await fetch(`/sprites/${prefix}`).then(r => r.ok ? r.json() : false).catch(() => false);
+      }));
+  }
+
+  function addIconThumbs() {
+      document.querySelectorAll('.icon-item').forEach(iconEl => {
+          if (iconEl.querySelector('.icon-thumb')) return;
+          const [prefix, name] = iconEl.dataset.iconName.split(':');
+          const thumb = iconThumb(prefix, name);
+          if (thumb) iconEl.insertAdjacentHTML('afterbegin', thumb);
+      });
+  }
+
+  function iconThumb(prefix, name) {
+      const map = spriteMaps[prefix];
+      const pos = map && map.icons[name];
+      if (!pos) return '';
+      const sheet = map.sheets[pos[0]];
+      const scale = 16 / map.size;
+      return `<span class="icon-thumb" style="background-image:url('${sheet.url}');` +
+             `background-size:${sheet.width * scale}px ${sheet.height * scale}px;` +
+             `background-position:-${pos[1] * scale}px -${pos[2] * scale}px"></span>`;
+  }
+
   async function rebuildIconRegistry() {
       mermaid.registerIconPacks([
           {
@@ -288,6 +623,15 @@ HTML = r"""
       ]);
   }
 
+  async function checkDiagramLimits(code) {
+      try {
+          const body = new URLSearchParams({ code });
+          return await fetch('/diagram-stats', { method: 'POST', body }).then(r => r.json());
+      } catch (e) {
+          return null;
+      }
+  }
+
   async function renderDiagram() {
       const el = document.getElementById('diagram');
       const err = document.getElementById('err');
@@ -307,6 +651,14 @@ HTML = r"""
               return;
           }
 
+          const check = await checkDiagramLimits(code);
+          if (check && !check.ok) {
+              el.style.borderColor = '#b91c1c';
+              el.style.backgroundColor = '#fff5f5';
+              err.textContent = 'Diagram too large to render:\n' + check.errors.join('\n') + '\n\n' + check.suggestion;
+              return;
+          }
+
           await rebuildIconRegistry();
 
           const { svg, bindFunctions } = await mermaid.render('mmd-' + Date.now(), code);
@@ -400,8 +752,9 @@ HTML = r"""
   
   // Klik tunggal: Tambah service
   iconList.addEventListener('click', (e) => {
-    if (e.target && e.target.classList.contains('icon-item')) {
-        const iconName = e.target.dataset.iconName;
+    const item = e.target && e.target.closest('.icon-item');
+    if (item) {
+        const iconName = item.dataset.iconName;
         const [_, namePart] = iconName.split(':');
         const baseId = namePart.replace(/-/g, '');
         
@@ -425,8 +778,9 @@ HTML = r"""
 
   // Klik ganda: Hapus service
   iconList.addEventListener('dblclick', (e) => {
-    if (e.target && e.target.classList.contains('icon-item')) {
-        const iconName = e.target.dataset.iconName;
+    const item = e.target && e.target.closest('.icon-item');
+    if (item) {
+        const iconName = item.dataset.iconName;
         const codeEl = document.getElementById('code');
         let currentCode = codeEl.value;
         
@@ -674,9 +1028,47 @@ def packs_status():
         "logos": OTHER_LOCAL.exists()
     })
 
+@app.route('/diagram-stats', methods=['POST'])
+def diagram_stats_route():
+    code = request.form.get('code') or ''
+    stats = diagram_stats(code)
+    errors = check_diagram_limits(stats)
+    body = {"ok": not errors, "stats": stats, "errors": errors}
+    if errors:
+        body["suggestion"] = split_suggestion(stats)
+    return jsonify(body), (422 if errors else 200)
+
+@app.route('/sprites/<pack_name>')
+def sprites(pack_name):
+    if pack_name not in PACK_FILES or not PACK_FILES[pack_name].exists():
+        return jsonify({"error": f"no local pack '{pack_name}'"}), 404
+    sprite_map = load_sprites(pack_name)
+    if sprite_map is None:
+        return jsonify({"error": "sprites not built, run: flask --app mermaid build-sprites"}), 404
+    return jsonify(sprite_map)
+
+@app.route('/static/sprites/<path:filename>')
+def serve_sprites(filename):
+    return send_from_directory(SPRITES_DIR, filename)
+
 @app.route('/static/packs/<path:filename>')
 def serve_packs(filename):
     return send_from_directory(PACKS_DIR, filename)
 
+@app.cli.command('build-sprites')
+def build_sprites_command():
+    """Pre-builds icon sprite sheets for every local pack."""
+    for pack_name, path in PACK_FILES.items():
+        if not path.exists():
+            continue
+        try:
+            sprite_map = build_sprites(pack_name)
+        except (ImportError, OSError) as e:
+            raise click.ClickException(f"sprite support unavailable (needs Pillow + CairoSVG/libcairo): {e}")
+        click.echo(f"{pack_name}: {len(sprite_map['icons'])} icons, {len(sprite_map['sheets'])} sheet(s), "
+                   f"{len(sprite_map['skipped'])} skipped")
+        for reason in sprite_map['skipped']:
+            click.echo(f"  skipped {reason}")
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)